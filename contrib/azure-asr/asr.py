@@ -6,7 +6,9 @@ import argparse
 import azure.cognitiveservices.speech as speechsdk
 import keyring
 import keyring.cli
-import re
+import random
+import shutil
+import signal
 import socket
 import subprocess
 import sys
@@ -14,6 +16,7 @@ import threading
 import time
 import unicodedata
 
+from functools import lru_cache
 from functools import partial as bind
 
 done = [False]
@@ -47,11 +50,14 @@ def get_input_stream(port):
     print("Connected to sndcat port %s" % port)
 
     def pipe(stream):
-        size = 16000 // 10 * 2
+        # 0.4 seconds of 16kHz 16-bit mono audio per read.
+        size = 16000 * 2 * 2 // 5
+        buf = bytearray(size)
+        view = memoryview(buf)
         try:
             while not is_stopped():
-                buf = sock.recv(size)
-                stream.write(buf)
+                n = sock.recv_into(view)
+                stream.write(bytes(view[:n]))
         except Exception as e:
             print("Cannot read from sndcat: %s" % (e,))
             mark_stopped()
@@ -86,13 +92,24 @@ class ASRTextOutput:
 class TerminalOutput(ASRTextOutput):
     def __init__(self):
         self._recognizing = ""
+        self._update_count = 0
+        self._update_termwidth()
+        if hasattr(signal, "SIGWINCH"):
+            signal.signal(signal.SIGWINCH, self._on_resize)
 
-    def recognizing(self, text):
-        import os
+    def _update_termwidth(self):
+        self._termwidth = shutil.get_terminal_size((80, 24)).columns or 80
+
+    def _on_resize(self, signum, frame):
+        self._update_termwidth()
 
+    def recognizing(self, text):
         self._recognizing = text
-        termwidth = os.get_terminal_size().columns or 80
-        text = truncate_left(text, termwidth, "...")
+        # Also refresh periodically in case SIGWINCH is unavailable (Windows).
+        self._update_count += 1
+        if self._update_count % 32 == 0:
+            self._update_termwidth()
+        text = truncate_left(text, self._termwidth, "...")
         sys.stdout.write(f"\r{text}\r")
         sys.stdout.flush()
 
@@ -107,18 +124,23 @@ class TerminalOutput(ASRTextOutput):
             sys.stdout.flush()
 
 
+@lru_cache(maxsize=4096)
+def east_asian_width(ch):
+    return unicodedata.east_asian_width(ch)
+
+
 def truncate_left(text, width_limit, prefix):
-    chars = list(text)
     width_current = len(prefix)
-    result = []
-    for ch in reversed(chars):
-        if unicodedata.east_asian_width(ch) == "Na":
+    i = len(text)
+    while i > 0:
+        ch = text[i - 1]
+        if ch < "\x80" or east_asian_width(ch) == "Na":
             width_current += 1
         else:
             width_current += 2
         if width_current >= width_limit:
-            return prefix + "".join(reversed(result))
-        result.append(ch)
+            return prefix + text[i:]
+        i -= 1
     return text
 
 
@@ -155,15 +177,27 @@ class QuipDocOutput(ASRTextOutput):
         self._recognized = ""
         self._recognizing = ""
         self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
         self._done = False
         threading.Thread(target=self._update_thread, daemon=True).start()
 
     def _update_thread(self):
         retry = 0
+        next_send = 0
         while self._is_running():
             text = ""
             temporary = True
-            with self._lock:
+            with self._cond:
+                # Quip has rate limit. Let text accumulate until the next
+                # request is allowed so it is sent as one edit.
+                self._cond.wait_for(
+                    lambda: not self._is_running()
+                    or (
+                        (self._recognized or self._recognizing)
+                        and time.monotonic() >= next_send
+                    ),
+                    timeout=max(next_send - time.monotonic(), 0) or None,
+                )
                 if self._recognized:
                     text = self._recognized
                     self._recognized = ""
@@ -176,42 +210,41 @@ class QuipDocOutput(ASRTextOutput):
             if text:
                 while self._is_running():
                     try:
-                        t1 = time.time()
+                        t1 = time.monotonic()
                         self._write(text, temporary=temporary)
-                        t2 = time.time()
-                        # Quip has rate limit.
-                        delay = 2 - (t2 - t1)
-                        if delay > 0:
-                            time.sleep(delay)
+                        next_send = t1 + 2
                         retry = 0
                         break
                     except Exception:
+                        # Exceed Rate Limit? Back off exponentially.
                         retry += 1
-                        if retry > 3:
-                            # Exceed Rate Limit? Wait 1 minute.
-                            for _i in range(61):
-                                if not self._is_running():
-                                    break
-                                time.sleep(1)
-                            retry = 0
+                        delay = min(2 ** retry, 60) * random.uniform(0.5, 1)
+                        with self._cond:
+                            self._cond.wait_for(
+                                lambda: not self._is_running(), timeout=delay
+                            )
 
     def _is_running(self):
         return not self._done and not is_stopped()
 
     def close(self):
-        self._done = True
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
         text = ""
         if self._temporary:
             text = self._recognized
             self._write(text, temporary=False)
 
     def recognizing(self, text):
-        with self._lock:
+        with self._cond:
             self._recognizing = text
+            self._cond.notify_all()
 
     def recognized(self, text):
-        with self._lock:
+        with self._cond:
             self._recognized += text + "<br>"
+            self._cond.notify_all()
 
     @property
     def section_id(self):
@@ -230,7 +263,11 @@ class QuipDocOutput(ASRTextOutput):
             self._thread_id, text, operation=operation, section_id=self._section_id
         )
         html = doc["html"]
-        self._section_id = re.findall("<p id='([^']*)'", html)[-1]
+        # Only the last section id is needed. Search from the end instead of
+        # scanning the whole document.
+        start = html.rindex("<p id='") + len("<p id='")
+        end = html.index("'", start)
+        self._section_id = html[start:end]
         self._temporary = temporary
 
 
@@ -316,9 +353,15 @@ def main(args):
         on_event(name, e)
         stop()
 
+    last_recognizing = [""]
+
     def on_recognizing(e):
         # on_event("Recognizing", e)
         text = e.result.text
+        # Azure might re-emit the same hypothesis. Skip redundant updates.
+        if text == last_recognizing[0]:
+            return
+        last_recognizing[0] = text
         for out in outs:
             try:
                 out.recognizing(text)
@@ -328,6 +371,7 @@ def main(args):
     def on_recognized(e):
         # on_event("Recognized", e)
         text = e.result.text
+        last_recognizing[0] = ""
         for out in outs:
             try:
                 out.recognized(text)